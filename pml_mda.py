@@ -1,14 +1,17 @@
-import locale
 import requests
-import os
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 from bs4 import BeautifulSoup, Tag
 import urllib.parse
 import logging
-import zipfile
-import glob
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import json
+import orjson
 from datetime import datetime
 
 # Logging Setup
@@ -22,7 +25,32 @@ logging.basicConfig(
 )
 
 
+# Reintentos con backoff exponencial ante errores transitorios (5xx, 429,
+# conexiones reiniciadas). raise_on_status=False devuelve la última respuesta
+# para que los chequeos de status_code existentes sigan manejando el error.
+RETRY = Retry(
+    total=5,
+    backoff_factor=1.0,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "POST"]),
+    raise_on_status=False,
+)
+# (connect, read) en segundos
+CENACE_TIMEOUT = (10, 60)
+API_TIMEOUT = (10, 180)
+
 API_BASE_URL = "http://127.0.0.1:5000"  # Or your server's address/port
+# Sesión compartida para reutilizar las conexiones keep-alive hacia la API
+API_SESSION = requests.Session()
+API_SESSION.headers.update({"Content-Type": "application/json"})
+API_SESSION.mount(
+    API_BASE_URL,
+    HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=RETRY),
+)
+API_MAX_WORKERS = 4  # Lotes enviados en paralelo (<= pool_maxsize)
+# Envía todos los registros en un solo POST (se divide solo si la API responde 413);
+# en False se usa el envío concurrente por lotes
+SINGLE_POST = True
 API_TARGET_SOURCE_PMLMDA = "data_source_1"
 URL = "https://www.cenace.gob.mx/Paginas/SIM/Reportes/PreEnerServConMDA.aspx"
 HEADERS = {
@@ -38,7 +66,6 @@ HEADERS = {
     "Cache-Control": "no-cache",
     "Origin": "https://www.cenace.gob.mx",
     "Connection": "keep-alive",
-    "Cookie": "ASP.NET_SessionId=t3gtzhr2evmtdfwdgla1niwh",
     "Sec-Fetch-Dest": "empty",
     "Sec-Fetch-Mode": "cors",
     "Sec-Fetch-Site": "same-origin",
@@ -46,15 +73,128 @@ HEADERS = {
 
 SISTEMAS = ["SIN", "BCA", "BCS"]
 
+# Abreviaturas de mes usadas por CENACE en "Fecha:" (p. ej. 14/oct/2025);
+# evita depender de locale.setlocale para interpretar %b en español
+SPANISH_MONTHS = {
+    "ene": 1,
+    "feb": 2,
+    "mar": 3,
+    "abr": 4,
+    "may": 5,
+    "jun": 6,
+    "jul": 7,
+    "ago": 8,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "dic": 12,
+}
+
+# Captura el valor de __VIEWSTATE en las respuestas parciales de ASP.NET
+VIEWSTATE_RE = re.compile(r"\|hiddenField\|__VIEWSTATE\|([^|]+)")
+# Captura el nombre del archivo en el encabezado Content-Disposition
+FILENAME_RE = re.compile(r'filename=(?:"([^"]+)"|([^;]+))')
+
+
+def format_hora(hora):
+    """
+    Formats an hour column (1-24) as 'HH:00:00' strings.
+
+    Args:
+        hora (pd.Series): Hour values; non-numeric values are treated as 0.
+
+    Returns:
+        np.ndarray: Object array of 'HH:00:00' strings, with hour 24 mapped to '00:00:00'.
+    """
+    # Ensure 'Hora' is numeric, coerce errors, fill NaNs (e.g., with 0), convert to int
+    h = pd.to_numeric(hora, errors="coerce").fillna(0).astype(int).to_numpy()
+
+    # Apply formatting: Map hour 24 to '00:00:00'
+    # Hour 24 usually represents the interval ending at midnight, which is 00:00 of the next day,
+    # but for a daily time value, 00:00:00 is the standard representation.
+    # Vectorized over the whole column: 1-23 keep their value, 24 and any other
+    # invalid value become 0, then everything is zero-padded to HH:00:00
+    hh = np.where((h >= 1) & (h <= 23), h, 0)
+    return np.char.add(np.char.zfill(hh.astype(str), 2), ":00:00").astype(object)
+
 
-def delete_csv_files(directory):
-    csv_files = glob.glob(os.path.join(directory, "*.csv"))
-    for file in csv_files:
-        os.remove(file)
-        logging.info(f"Deleted: {file}")
+def post_payload(full_api_url, payload):
+    """
+    Sends a list of records to the API in a single JSON POST request.
 
+    If the server rejects the body as too large (HTTP 413), the records are split
+    in halves and each half is sent recursively.
 
-def send_dataframe_to_api(df_to_send, api_base_url, target_source):
+    Args:
+        full_api_url (str): The full endpoint URL (e.g., ".../api/v1/mercado/data_source_1").
+        payload (list[dict]): The records to send.
+
+    Returns:
+        bool: True if every record was accepted with a 2xx status code, False otherwise.
+    """
+    api_success = False
+    try:
+        logging.info(f"Sending {len(payload)} records to API...")
+        response = API_SESSION.post(
+            full_api_url,
+            # orjson is much faster than the stdlib encoder; the session already
+            # sends the application/json Content-Type header
+            data=orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+            timeout=API_TIMEOUT,  # (connect, read) timeouts in seconds
+        )
+
+        # Check if the request was successful (status code 2xx)
+        response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
+
+        logging.info(f"API call successful! Status Code: {response.status_code}")
+        try:
+            # Log the response from the API (if JSON)
+            api_result = response.json()
+            logging.info("API Response:")
+            logging.info(json.dumps(api_result, indent=2))
+        except json.JSONDecodeError:
+            logging.info("API Response (non-JSON):")
+            logging.info(response.text)
+
+        api_success = True  # Mark as success
+
+    except requests.exceptions.ConnectionError as e:
+        logging.error(
+            f"API Connection Error: Could not connect to {full_api_url}. Is the server running? Details: {e}"
+        )
+    except requests.exceptions.Timeout:
+        logging.error(f"API Error: The request to {full_api_url} timed out.")
+    except requests.exceptions.HTTPError as e:
+        # Error raised by response.raise_for_status() for 4xx/5xx responses
+        if e.response.status_code == 413 and len(payload) > 1:
+            # Payload too large for the server: split it in halves and retry each
+            middle = len(payload) // 2
+            logging.warning(
+                f"API rejected {len(payload)} records as too large (413). Splitting into {middle} and {len(payload) - middle} records."
+            )
+            first_half_ok = post_payload(full_api_url, payload[:middle])
+            second_half_ok = post_payload(full_api_url, payload[middle:])
+            return first_half_ok and second_half_ok
+        logging.error(f"API HTTP Error: Status Code {e.response.status_code}")
+        logging.error(f"Reason: {e.response.reason}")
+        logging.error(
+            f"Response Body: {e.response.text}"
+        )  # Show error details from API
+    except requests.exceptions.RequestException as e:
+        # Catch other potential request errors (e.g., URL issues)
+        logging.error(
+            f"API Request Error: An error occurred during the request. Details: {e}"
+        )
+    except Exception as e:
+        # Catch any other unexpected errors (e.g., during payload creation if missed earlier)
+        logging.error(f"An unexpected error occurred: {e}")
+
+    return api_success
+
+
+def send_dataframe_to_api(
+    df_to_send, api_base_url, target_source, already_transformed=False
+):
     """
     Transforms a DataFrame and sends its data as JSON to the specified API endpoint.
 
@@ -66,6 +206,9 @@ def send_dataframe_to_api(df_to_send, api_base_url, target_source):
         api_base_url (str): The base URL of the Flask API (e.g., "http://127.0.0.1:5000").
         target_source (str): The target source key for the API URL path
                              (e.g., "data_source_1", "data_source_3").
+        already_transformed (bool): If True, 'Fecha' already holds 'YYYY-MM-DD' strings
+                                    and 'Hora' holds 'HH:00:00' strings, so both are
+                                    sent as-is without being transformed again.
 
     Returns:
         bool: True if the API call resulted in a 2xx status code, False otherwise.
@@ -82,10 +225,7 @@ def send_dataframe_to_api(df_to_send, api_base_url, target_source):
 
     logging.info(f"Preparing data for API endpoint '{target_source}'...")
 
-    # --- 1. Create a copy to avoid modifying the original DataFrame ---
-    df_api = df_to_send.copy()
-
-    # --- 2. Verify required columns exist ---
+    # --- 1. Verify required columns exist ---
     required_cols = [
         "Sistema",
         "Fecha",
@@ -96,77 +236,74 @@ def send_dataframe_to_api(df_to_send, api_base_url, target_source):
         "Congestion",
         "Perdidas",
     ]
-    missing_cols = [col for col in required_cols if col not in df_api.columns]
+    missing_cols = [col for col in required_cols if col not in df_to_send.columns]
     if missing_cols:
         logging.error(
             f"DataFrame is missing required columns for the API: {missing_cols}"
         )
         return False
 
-    # --- 3. Transform 'Fecha' column ---
-    # Convert to datetime objects first (handles various string formats), then format to 'YYYY-MM-DD' string.
-    try:
-        # pd.to_datetime is robust in parsing various date formats
-        df_api["Fecha"] = pd.to_datetime(df_api["Fecha"]).dt.strftime("%Y-%m-%d")
-        logging.debug("'Fecha' column formatted to YYYY-MM-DD.")
-    except Exception as e:
-        logging.error(
-            f"Failed to parse or format the 'Fecha' column. Ensure it contains valid dates. Error: {e}"
-        )
-        return False
-
-    # --- 4. Transform 'Hora' column ---
-    try:
-        # Ensure 'Hora' is numeric, coerce errors, fill NaNs (e.g., with 0), convert to int
-        df_api["Hora"] = (
-            pd.to_numeric(df_api["Hora"], errors="coerce").fillna(0).astype(int)  # type: ignore
-        )
-
-        # Apply formatting: Map hour 24 to '00:00:00'
-        # Hour 24 usually represents the interval ending at midnight, which is 00:00 of the next day,
-        # but for a daily time value, 00:00:00 is the standard representation.
-        df_api["Hora"] = df_api["Hora"].apply(
-            lambda h: "00:00:00"
-            if h == 24
-            else (f"{h:02d}:00:00" if 1 <= h <= 23 else "00:00:00")
-            # This handles 1-23 correctly, maps 24 to 00:00:00, and treats other invalid values as 00:00:00
-        )
-        logging.debug(
-            "'Hora' column formatted to HH:00:00 (with 24 mapped to 00:00:00)."
-        )
-    except Exception as e:
-        logging.error(
-            f"Failed to process the 'Hora' column. Ensure it contains numeric hour values (1-24). Error: {e}"
-        )
-        return False
+    # --- 2. Extract only the columns required by the API as arrays ---
+    # Working on a dict of arrays instead of a DataFrame copy means only the
+    # columns that are sent get materialized. Object dtype yields plain Python
+    # scalars and missing values become None (null in the JSON payload).
+    # 'Fecha' and 'Hora' are transformed below unless the caller already did it
+    to_transform = () if already_transformed else ("Fecha", "Hora")
+    cols = {
+        col: df_to_send[col].to_numpy(dtype=object, na_value=None)
+        for col in required_cols
+        if col not in to_transform
+    }
+
+    if not already_transformed:
+        # --- 3. Transform 'Fecha' column ---
+        # Convert to datetime objects first (handles various string formats), then format to 'YYYY-MM-DD' string.
+        try:
+            # pd.to_datetime is robust in parsing various date formats
+            cols["Fecha"] = (
+                pd.to_datetime(df_to_send["Fecha"])
+                .dt.strftime("%Y-%m-%d")
+                .to_numpy(dtype=object)
+            )
+            logging.debug("'Fecha' column formatted to YYYY-MM-DD.")
+        except Exception as e:
+            logging.error(
+                f"Failed to parse or format the 'Fecha' column. Ensure it contains valid dates. Error: {e}"
+            )
+            return False
 
-    # --- 5. Select only the columns required by the API ---
-    # Ensures no extra columns are sent and sets a specific order (though order doesn't matter in JSON objects)
-    try:
-        df_api = df_api[required_cols]
-    except KeyError:
-        # This check should be redundant due to the check in step 2, but added for extra safety
-        logging.error(
-            "One of the required columns was lost during processing. This should not happen."
-        )
-        return False
+        # --- 4. Transform 'Hora' column ---
+        try:
+            cols["Hora"] = format_hora(df_to_send["Hora"])
+            logging.debug(
+                "'Hora' column formatted to HH:00:00 (with 24 mapped to 00:00:00)."
+            )
+        except Exception as e:
+            logging.error(
+                f"Failed to process the 'Hora' column. Ensure it contains numeric hour values (1-24). Error: {e}"
+            )
+            return False
 
-    # --- 6. Convert DataFrame to JSON list of dictionaries ---
+    # --- 5. Convert the column arrays to a JSON list of dictionaries ---
     # This is the format the Flask endpoint expects (request.get_json())
     try:
-        payload = df_api.to_dict("records")  # type: ignore
-        print(payload)
+        # Zip the rows together from the column arrays instead of going through
+        # the row-wise DataFrame.to_dict("records").
+        payload = [
+            dict(zip(required_cols, row))
+            for row in zip(*(cols[col] for col in required_cols))
+        ]
         logging.info(
             f"Successfully converted DataFrame to JSON payload ({len(payload)} records)."
         )
-        # Optional: print first record to verify format
-        # if payload:
-        #    logging.debug(f"Sample payload record: {json.dumps(payload[0], indent=2)}")
+        # Log only the first record, and only when DEBUG logging is enabled
+        if payload and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Sample payload record: {payload[0]}")
     except Exception as e:
         logging.error(f"Failed to convert DataFrame to dictionary list: {e}")
         return False
 
-    # --- 7. Construct the full API URL ---
+    # --- 6. Construct the full API URL ---
     if not api_base_url.endswith("/"):
         api_base_url += "/"
     # Ensure target_source doesn't start with /
@@ -175,89 +312,49 @@ def send_dataframe_to_api(df_to_send, api_base_url, target_source):
     full_api_url = f"{api_base_url}api/v1/mercado/{target_source_cleaned}"
     logging.info(f"Target API URL: {full_api_url}")
 
-    # --- 8. Make the POST request ---
-    api_success = False
-    try:
-        logging.info(f"Sending {len(payload)} records to API...")
-        response = requests.post(
-            full_api_url,
-            json=payload,  # requests handles JSON serialization and headers
-            timeout=180,  # Set a timeout (in seconds) for the request
-        )
+    # --- 7. Make the POST request ---
+    return post_payload(full_api_url, payload)
 
-        # Check if the request was successful (status code 2xx)
-        response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
 
-        logging.info(f"API call successful! Status Code: {response.status_code}")
-        try:
-            # Log the response from the API (if JSON)
-            api_result = response.json()
-            logging.info("API Response:")
-            logging.info(json.dumps(api_result, indent=2))
-        except json.JSONDecodeError:
-            logging.info("API Response (non-JSON):")
-            logging.info(response.text)
-
-        api_success = True  # Mark as success
-
-    except requests.exceptions.ConnectionError as e:
-        logging.error(
-            f"API Connection Error: Could not connect to {api_base_url}. Is the server running? Details: {e}"
-        )
-    except requests.exceptions.Timeout:
-        logging.error(f"API Error: The request to {full_api_url} timed out.")
-    except requests.exceptions.HTTPError as e:
-        # Error raised by response.raise_for_status() for 4xx/5xx responses
-        logging.error(f"API HTTP Error: Status Code {e.response.status_code}")
-        logging.error(f"Reason: {e.response.reason}")
-        logging.error(
-            f"Response Body: {e.response.text}"
-        )  # Show error details from API
-    except requests.exceptions.RequestException as e:
-        # Catch other potential request errors (e.g., URL issues)
-        logging.error(
-            f"API Request Error: An error occurred during the request. Details: {e}"
-        )
-    except Exception as e:
-        # Catch any other unexpected errors (e.g., during payload creation if missed earlier)
-        logging.error(f"An unexpected error occurred: {e}")
+def content_digest(content):
+    """Calcula el hash BLAKE2b del contenido de un CSV descargado."""
+    return hashlib.blake2b(content, digest_size=16).digest()
 
-    return api_success
-
-
-def are_files_different(file1, file2):
-    """Compara el contenido de dos archivos y devuelve True si son diferentes."""
-    with open(file1, "r") as f1, open(file2, "r") as f2:
-        return f1.read() != f2.read()
-
-
-# Extract dates from the files
-def extract_date(file_path):
-    with open(file_path, "r") as file:
-        for line in file:
-            if "Fecha:" in line:  # Check if "Fecha:" is in the line
-                date = (
-                    line.split("Fecha:")[1].strip().strip('"')
-                )  # Remove quotes if present
-                return date
-    return None
 
+def preprocess_csv(file, system_name):
+    """
+    Lee un CSV de CENACE recorriendo su encabezado una sola vez.
 
-def find_hour_row(file_path):
-    with open(file_path, "r") as file:
-        for i, line in enumerate(file):
-            if "Hora" in line:
-                return i
-    return -1  # Return -1 if "Hora" is not found
-
+    Parámetros:
+    - file: Archivo binario con el contenido del CSV (p. ej. io.BytesIO).
+    - system_name: Sistema al que pertenece el archivo (SIN, BCA o BCS).
 
-def preprocess_csv(file_path, system_name):
-    row_index = find_hour_row(file_path)
-    skiprows = row_index if row_index != -1 else 7
-    df = pd.read_csv(file_path, delimiter=",", skiprows=skiprows)
+    Retorna:
+    - Tupla (df, date) con los datos y el valor de "Fecha:" del encabezado
+      (None si no se encuentra).
+    """
+    date = None
+    # Avanza hasta la fila "Hora" y regresa al inicio de esa línea, así
+    # pd.read_csv continúa desde el mismo archivo sin depender de skiprows
+    # (el motor pyarrow no cuenta las líneas vacías del encabezado)
+    while True:
+        position = file.tell()
+        line = file.readline()
+        if not line:
+            # Sin fila "Hora": se asume el encabezado estándar de 7 líneas
+            file.seek(0)
+            for _ in range(7):
+                file.readline()
+            break
+        if date is None and b"Fecha:" in line:
+            date = line.decode().split("Fecha:")[1].strip().strip('"')
+        if b"Hora" in line:
+            file.seek(position)
+            break
+    df = pd.read_csv(file, delimiter=",", engine="pyarrow", dtype_backend="pyarrow")
     df["Sistema"] = system_name
     df.columns = [col.replace("($/MWh)", "").strip() for col in df.columns]
-    return df
+    return df, date
 
 
 def extract_field_value(soup: BeautifulSoup, field_name: str, html_element: str) -> str:
@@ -277,121 +374,117 @@ def extract_field_value(soup: BeautifulSoup, field_name: str, html_element: str)
     return str(element)
 
 
-def get_pml_mda():
-    session = requests.session()
-    response = session.get(URL, headers={"User-Agent": "Mozilla/5.0"})
-    soup = BeautifulSoup(response.text, "html.parser")
-    view_state = extract_field_value(soup, "__VIEWSTATE", "input")
-    period = extract_field_value(soup, "ctl00$ContentPlaceHolder1$txtPeriodo", "input")
-    date = extract_field_value(
-        soup, "ctl00$ContentPlaceHolder1$hdfStartDateSelected", "input"
-    )
-
-    for sistema in SISTEMAS:
-        data = {
-            "ctl00$ContentPlaceHolder1$ScriptManager": "ctl00$ContentPlaceHolder1$ScriptManager|ctl00$ContentPlaceHolder1$ddlReporte",
-            "ctl00$ContentPlaceHolder1$ddlReporte": "359,322",
-            "ctl00$ContentPlaceHolder1$ddlPeriodicidad": "D",
-            "ctl00$ContentPlaceHolder1$ddlSistema": sistema,
-            "ctl00$ContentPlaceHolder1$txtPeriodo": period,
-            "ctl00$ContentPlaceHolder1$hdfStartDateSelected": date,
-            "ctl00$ContentPlaceHolder1$hdfEndDateSelected": date,
-            "ctl00$ContentPlaceHolder1$hdfMinDateToSelect": "29/03/2016",
-            "ctl00$ContentPlaceHolder1$hdfMaxDateToSelect": date,
-            "__EVENTTARGET": "ctl00$ContentPlaceHolder1$ddlReporte",
-            "__EVENTARGUMENT": "",
-            "__LASTFOCUS": "",
-            "__VIEWSTATE": view_state,
-            "__VIEWSTATEGENERATOR": "35C9E14B",
-            "__VIEWSTATEENCRYPTED": "",
-            "__ASYNCPOST": "true",
-            "": "",
-        }
-
-        response = session.post(URL, headers=HEADERS, data=data)
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # Regular expression to capture the VIEWSTATE value
-        match = re.search(r"\|hiddenField\|__VIEWSTATE\|([^|]+)", response.text)
-
-        view_state_value = ""
-
-        if match:
-            view_state_value = match.group(1)
-        else:
-            print("VIEWSTATE not found.")
-
-        body = {
-            "ctl00$ContentPlaceHolder1$ScriptManager": "ctl00$ContentPlaceHolder1$ScriptManager|ctl00$ContentPlaceHolder1$txtPeriodo",
-            "ctl00$ContentPlaceHolder1$ddlReporte": "359,322",
-            "ctl00$ContentPlaceHolder1$ddlPeriodicidad": "D",
-            "ctl00$ContentPlaceHolder1$ddlSistema": sistema,
-            "ctl00$ContentPlaceHolder1$txtPeriodo": period,
-            "ctl00$ContentPlaceHolder1$hdfStartDateSelected": date,
-            "ctl00$ContentPlaceHolder1$hdfEndDateSelected": date,
-            "ctl00$ContentPlaceHolder1$hdfMinDateToSelect": "29/01/2016",
-            "ctl00$ContentPlaceHolder1$hdfMaxDateToSelect": date,
-            "__EVENTTARGET": "ctl00$ContentPlaceHolder1$txtPeriodo",
-            "__EVENTARGUMENT": "",
-            "__LASTFOCUS": "",
-            "__VIEWSTATE": view_state_value,
-            "__VIEWSTATEGENERATOR": "35C9E14B",
-            "__VIEWSTATEENCRYPTED": "",
-            "__ASYNCPOST": "true",
-            "": "",
-        }
-
-        response = session.post(URL, headers=HEADERS, data=body)
-        soup = BeautifulSoup(response.text, "html.parser")
-        # Regular expression to capture the VIEWSTATE value
-        match = re.search(r"\|hiddenField\|__VIEWSTATE\|([^|]+)", response.text)
-
-        new_view_state_value = ""
-        if match:
-            # new_view_state_value = match.group(1)
-            new_view_state_value = urllib.parse.quote_plus(match.group(1), safe="")
-        else:
-            print("VIEWSTATE not found.")
-
-        period_encoded = urllib.parse.quote_plus(str(period), safe="")
-        date_encoded = urllib.parse.quote_plus(str(date), safe="")
+def download_sistema_csv(session, sistema, view_state, period, date):
+    """
+    Descarga el ZIP de un sistema y extrae el CSV en memoria.
 
-        marg_data = f"ctl00%24ContentPlaceHolder1%24ddlReporte=359%2C322&ctl00%24ContentPlaceHolder1%24ddlPeriodicidad=D&ctl00%24ContentPlaceHolder1%24ddlSistema={sistema}&ctl00%24ContentPlaceHolder1%24txtPeriodo={period_encoded}&ctl00%24ContentPlaceHolder1%24hdfStartDateSelected={date_encoded}&ctl00%24ContentPlaceHolder1%24hdfEndDateSelected={date_encoded}&ctl00%24ContentPlaceHolder1%24hdfMinDateToSelect=29%2F01%2F2016&ctl00%24ContentPlaceHolder1%24hdfMaxDateToSelect={date_encoded}&ctl00%24ContentPlaceHolder1%24btnDescargarZIP=Descargar+ZIP&__EVENTTARGET=&__EVENTARGUMENT=&__LASTFOCUS=&__VIEWSTATE={new_view_state_value}&__VIEWSTATEGENERATOR=35C9E14B&__VIEWSTATEENCRYPTED="
+    Parámetros:
+    - session: Sesión de requests compartida para toda la cadena GET/POST.
+    - sistema: Sistema eléctrico a descargar (SIN, BCA o BCS).
+    - view_state: Valor inicial de __VIEWSTATE de la página.
+    - period: Valor del campo txtPeriodo.
+    - date: Valor del campo hdfStartDateSelected.
 
-        response = session.post(URL, headers=HEADERS, data=marg_data)
+    Retorna:
+    - Contenido del CSV (bytes), o None si la descarga falló.
+    """
+    import zipfile
+
+    data = {
+        "ctl00$ContentPlaceHolder1$ScriptManager": "ctl00$ContentPlaceHolder1$ScriptManager|ctl00$ContentPlaceHolder1$ddlReporte",
+        "ctl00$ContentPlaceHolder1$ddlReporte": "359,322",
+        "ctl00$ContentPlaceHolder1$ddlPeriodicidad": "D",
+        "ctl00$ContentPlaceHolder1$ddlSistema": sistema,
+        "ctl00$ContentPlaceHolder1$txtPeriodo": period,
+        "ctl00$ContentPlaceHolder1$hdfStartDateSelected": date,
+        "ctl00$ContentPlaceHolder1$hdfEndDateSelected": date,
+        "ctl00$ContentPlaceHolder1$hdfMinDateToSelect": "29/03/2016",
+        "ctl00$ContentPlaceHolder1$hdfMaxDateToSelect": date,
+        "__EVENTTARGET": "ctl00$ContentPlaceHolder1$ddlReporte",
+        "__EVENTARGUMENT": "",
+        "__LASTFOCUS": "",
+        "__VIEWSTATE": view_state,
+        "__VIEWSTATEGENERATOR": "35C9E14B",
+        "__VIEWSTATEENCRYPTED": "",
+        "__ASYNCPOST": "true",
+        "": "",
+    }
+
+    response = session.post(URL, headers=HEADERS, data=data, timeout=CENACE_TIMEOUT)
+
+    # Regular expression to capture the VIEWSTATE value
+    match = VIEWSTATE_RE.search(response.text)
+
+    view_state_value = ""
+
+    if match:
+        view_state_value = match.group(1)
+    else:
+        print("VIEWSTATE not found.")
+
+    body = {
+        "ctl00$ContentPlaceHolder1$ScriptManager": "ctl00$ContentPlaceHolder1$ScriptManager|ctl00$ContentPlaceHolder1$txtPeriodo",
+        "ctl00$ContentPlaceHolder1$ddlReporte": "359,322",
+        "ctl00$ContentPlaceHolder1$ddlPeriodicidad": "D",
+        "ctl00$ContentPlaceHolder1$ddlSistema": sistema,
+        "ctl00$ContentPlaceHolder1$txtPeriodo": period,
+        "ctl00$ContentPlaceHolder1$hdfStartDateSelected": date,
+        "ctl00$ContentPlaceHolder1$hdfEndDateSelected": date,
+        "ctl00$ContentPlaceHolder1$hdfMinDateToSelect": "29/01/2016",
+        "ctl00$ContentPlaceHolder1$hdfMaxDateToSelect": date,
+        "__EVENTTARGET": "ctl00$ContentPlaceHolder1$txtPeriodo",
+        "__EVENTARGUMENT": "",
+        "__LASTFOCUS": "",
+        "__VIEWSTATE": view_state_value,
+        "__VIEWSTATEGENERATOR": "35C9E14B",
+        "__VIEWSTATEENCRYPTED": "",
+        "__ASYNCPOST": "true",
+        "": "",
+    }
+
+    response = session.post(URL, headers=HEADERS, data=body, timeout=CENACE_TIMEOUT)
+    # Regular expression to capture the VIEWSTATE value
+    match = VIEWSTATE_RE.search(response.text)
+
+    new_view_state_value = ""
+    if match:
+        # new_view_state_value = match.group(1)
+        new_view_state_value = urllib.parse.quote_plus(match.group(1), safe="")
+    else:
+        print("VIEWSTATE not found.")
+
+    period_encoded = urllib.parse.quote_plus(str(period), safe="")
+    date_encoded = urllib.parse.quote_plus(str(date), safe="")
+
+    marg_data = f"ctl00%24ContentPlaceHolder1%24ddlReporte=359%2C322&ctl00%24ContentPlaceHolder1%24ddlPeriodicidad=D&ctl00%24ContentPlaceHolder1%24ddlSistema={sistema}&ctl00%24ContentPlaceHolder1%24txtPeriodo={period_encoded}&ctl00%24ContentPlaceHolder1%24hdfStartDateSelected={date_encoded}&ctl00%24ContentPlaceHolder1%24hdfEndDateSelected={date_encoded}&ctl00%24ContentPlaceHolder1%24hdfMinDateToSelect=29%2F01%2F2016&ctl00%24ContentPlaceHolder1%24hdfMaxDateToSelect={date_encoded}&ctl00%24ContentPlaceHolder1%24btnDescargarZIP=Descargar+ZIP&__EVENTTARGET=&__EVENTARGUMENT=&__LASTFOCUS=&__VIEWSTATE={new_view_state_value}&__VIEWSTATEGENERATOR=35C9E14B&__VIEWSTATEENCRYPTED="
+
+    # Descarga en streaming directo a un buffer en memoria
+    with session.post(
+        URL, headers=HEADERS, data=marg_data, stream=True, timeout=CENACE_TIMEOUT
+    ) as response:
         if response.status_code == 200:
             # Verifica el encabezado Content-Disposition
             content_disposition = response.headers.get("Content-Disposition", "")
 
             if "attachment" in content_disposition and ".zip" in content_disposition:
                 # Extrae el nombre real del archivo ZIP si está presente en la cabecera
-                # current_directory = os.path.dirname(os.path.abspath(__file__))
                 filename = "resultado.zip"
-                # file_path = os.path.join(current_directory, filename)
                 if "filename=" in content_disposition:
-                    filename_match = re.search(
-                        r'filename=(?:"([^"]+)"|([^;]+))', content_disposition
-                    )
+                    filename_match = FILENAME_RE.search(content_disposition)
                     if filename_match:
                         filename = filename_match.group(1) or filename_match.group(2)
 
-                # Guarda el archivo ZIP descargado
-                with open(filename, "wb") as f:
-                    f.write(response.content)
+                # Descarga y descomprime en memoria, sin escribir el ZIP ni el
+                # CSV en disco
+                buffer = io.BytesIO()
+                for chunk in response.iter_content(chunk_size=65536):
+                    buffer.write(chunk)
                 logging.info(f"Archivo ZIP '{filename}' descargado exitosamente")
-                # Extrae el contenido del ZIP
-                with zipfile.ZipFile(filename, "r") as zip_ref:
-                    zip_ref.extractall()
-                # Elimina el ZIP después de extraerlo
-                os.remove(filename)
-                logging.info(f"Archivo ZIP '{filename}' eliminado exitosamente")
-                # Busca archivos con un nombre similar pero diferentes extensiones
-                base_name = os.path.splitext(filename)[0]
-                csv_file = glob.glob(f"{base_name}.*")
-                # Renombra el archivo CSV con el nombre del sistema
-                new_filename = f"PML_MDA_{sistema}.csv"
-                os.rename(csv_file[0], new_filename)
-                logging.info(f"Archivo CSV renombrado a '{new_filename}'")
+                with zipfile.ZipFile(buffer) as zip_ref:
+                    member = zip_ref.namelist()[0]
+                    content = zip_ref.read(member)
+                logging.info(f"CSV '{member}' extraído para el sistema {sistema}")
+                return content
             else:
                 logging.warning(
                     "Advertencia: La respuesta no parece ser un archivo ZIP"
@@ -403,55 +496,83 @@ def get_pml_mda():
             logging.error(
                 f"La solicitud falló con el código de estado: {response.status_code}"
             )
+    return None
+
+
+def scrape_sistema(sistema):
+    """
+    Ejecuta la cadena completa GET/POST de CENACE para un sistema.
+
+    Cada llamada crea su propia sesión y obtiene su propio __VIEWSTATE y cookie
+    de sesión ASP.NET, por lo que es segura para ejecutarse en varios hilos.
+
+    Parámetros:
+    - sistema: Sistema eléctrico a descargar (SIN, BCA o BCS).
+
+    Retorna:
+    - Contenido del CSV (bytes), o None si la descarga falló.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=RETRY, pool_maxsize=8))
+    response = session.get(
+        URL, headers={"User-Agent": "Mozilla/5.0"}, timeout=CENACE_TIMEOUT
+    )
+    soup = BeautifulSoup(response.text, "lxml")
+    view_state = extract_field_value(soup, "__VIEWSTATE", "input")
+    period = extract_field_value(soup, "ctl00$ContentPlaceHolder1$txtPeriodo", "input")
+    date = extract_field_value(
+        soup, "ctl00$ContentPlaceHolder1$hdfStartDateSelected", "input"
+    )
+    return download_sistema_csv(session, sistema, view_state, period, date)
+
+
+def get_pml_mda():
+    # Las descargas de cada sistema solo esperan red, se ejecutan en paralelo
+    with ThreadPoolExecutor(max_workers=len(SISTEMAS)) as executor:
+        csv_contents = dict(zip(SISTEMAS, executor.map(scrape_sistema, SISTEMAS)))
+
+    missing = [sistema for sistema, content in csv_contents.items() if content is None]
+    if missing:
+        logging.error(
+            f"Error: CSV de {missing} no descargado. Asegúrate de que todos los CSV requeridos estén descargados."
+        )
+        return False
 
     try:
         # Verifica si todos los archivos son diferentes
-        csv_files = [f for f in os.listdir() if f.endswith(".csv")]
-
+        # Un solo hash por archivo en lugar de comparar cada par de archivos
+        digests = {}
         all_different = True
-        for i in range(len(csv_files)):
-            for j in range(i + 1, len(csv_files)):
-                if not are_files_different(csv_files[i], csv_files[j]):
-                    # Para windows
-                    if os.name == "nt":
-                        os.system("cls")
-                    # Para mac and linux(here, os.name is 'posix')
-                    else:
-                        os.system("clear")
-                    logging.warning(
-                        f"Files {csv_files[i]} and {csv_files[j]} are identical. Skipping merge."
-                    )
-                    all_different = False
-                    break
-            if not all_different:
+        for sistema, content in csv_contents.items():
+            digest = content_digest(content)
+            if digest in digests:
+                logging.warning(
+                    f"Files for {digests[digest]} and {sistema} are identical. Skipping merge."
+                )
+                all_different = False
                 break
+            digests[digest] = sistema
 
         if all_different:
             logging.info("All files are different. Proceeding to merge.")
 
-            date_sin = extract_date("PML_MDA_SIN.csv")
-            date_bca = extract_date("PML_MDA_BCA.csv")
-            date_bcs = extract_date("PML_MDA_BCS.csv")
+            df_sin, date_sin = preprocess_csv(io.BytesIO(csv_contents["SIN"]), "SIN")
+            df_bca, date_bca = preprocess_csv(io.BytesIO(csv_contents["BCA"]), "BCA")
+            df_bcs, date_bcs = preprocess_csv(io.BytesIO(csv_contents["BCS"]), "BCS")
 
             if date_sin == date_bca == date_bcs:
                 logging.info(f"Dates match: {date_sin}. Proceeding to merge.")
 
-                df_sin = preprocess_csv("PML_MDA_SIN.csv", "SIN")
-                df_bca = preprocess_csv("PML_MDA_BCA.csv", "BCA")
-                df_bcs = preprocess_csv("PML_MDA_BCS.csv", "BCS")
-
                 df_sin_actualizado = pd.concat(
                     [df_sin, df_bca, df_bcs], ignore_index=True
                 )
 
-                if os.name == "nt":
-                    # Para mac and linux(here, os.name is 'posix')
-                    locale.setlocale(locale.LC_TIME, "es_ES.UTF-8")  # on windows
-                else:
-                    locale.setlocale(locale.LC_TIME, "es_ES.utf8")  # on Linux/macOS
-
-                dt = datetime.strptime(date_sin or "", "%d/%b/%Y")
-                df_sin_actualizado["Fecha"] = dt
+                day, month, year = (date_sin or "").split("/")
+                dt = datetime(int(year), SPANISH_MONTHS[month[:3].lower()], int(day))
+                # Fecha y Hora se formatean una sola vez aquí en lugar de en cada
+                # envío a la API
+                df_sin_actualizado["Fecha"] = dt.strftime("%Y-%m-%d")
+                df_sin_actualizado["Hora"] = format_hora(df_sin_actualizado["Hora"])
                 df_sin_actualizado = df_sin_actualizado.rename(
                     columns={
                         "Clave del nodo": "Clave",
@@ -463,49 +584,64 @@ def get_pml_mda():
                 )
                 print(df_sin_actualizado.head())
 
-                # --- Instead of sending all at once, send in batches ---
-                BATCH_SIZE = (
-                    100  # <<< Choose a batch size (e.g., 100, 250, 500) - Tune this!
-                )
                 num_records = len(df_sin_actualizado)
-                num_batches = (
-                    num_records + BATCH_SIZE - 1
-                ) // BATCH_SIZE  # Calculate needed batches
-
                 overall_success = True  # Track if all batches succeeded
                 records_successfully_sent_count = 0
-                logging.info("--- Starting API Upload ---")
-                logging.info(f"Total records to send: {num_records}")
-                logging.info(f"Batch size: {BATCH_SIZE}")
-                logging.info(f"Number of batches: {num_batches}")
-                for i in range(num_batches):
-                    start_index = i * BATCH_SIZE
-                    # end_index calculation ensures we don't go past the end of the DataFrame
-                    end_index = min(start_index + BATCH_SIZE, num_records)
-
-                    # Select the batch from the DataFrame using row indices
-                    df_batch = df_sin_actualizado.iloc[start_index:end_index]
-
-                    logging.info(
-                        f"--- Sending Batch {i + 1}/{num_batches} (Records {start_index + 1}-{end_index}) ---"
-                    )
-
-                    if df_batch.empty:
-                        logging.warning(f"Batch {i + 1} is empty, skipping.")
-                        continue
-
-                    # Call the existing function with the smaller batch DataFrame
-                    batch_success = send_dataframe_to_api(
-                        df_batch, API_BASE_URL, API_TARGET_SOURCE_PMLMDA
-                    )
-                    if batch_success:
-                        logging.info(f"Batch {i + 1}/{num_batches} sent successfully.")
-                        records_successfully_sent_count += len(df_batch)
+                if SINGLE_POST:
+                    # One request for everything; post_payload halves it on a 413
+                    logging.info("--- Starting API Upload (single request) ---")
+                    logging.info(f"Total records to send: {num_records}")
+                    if send_dataframe_to_api(
+                        df_sin_actualizado,
+                        API_BASE_URL,
+                        API_TARGET_SOURCE_PMLMDA,
+                        already_transformed=True,
+                    ):
+                        records_successfully_sent_count = num_records
                     else:
-                        logging.error(
-                            f"Failed to send Batch {i + 1}/{num_batches}. Check logs above."
-                        )
                         overall_success = False
+                else:
+                    # --- Instead of sending all at once, send in batches ---
+                    BATCH_SIZE = 100  # <<< Choose a batch size (e.g., 100, 250, 500) - Tune this!
+                    batches = [
+                        df_sin_actualizado.iloc[start : start + BATCH_SIZE]
+                        for start in range(0, num_records, BATCH_SIZE)
+                    ]
+                    num_batches = len(batches)
+                    logging.info("--- Starting API Upload ---")
+                    logging.info(f"Total records to send: {num_records}")
+                    logging.info(f"Batch size: {BATCH_SIZE}")
+                    logging.info(f"Number of batches: {num_batches}")
+                    # Keep several batches in flight over the pooled API_SESSION
+                    with ThreadPoolExecutor(max_workers=API_MAX_WORKERS) as executor:
+                        futures = {}
+                        for i, df_batch in enumerate(batches):
+                            start_index = i * BATCH_SIZE
+                            end_index = start_index + len(df_batch)
+                            logging.info(
+                                f"--- Sending Batch {i + 1}/{num_batches} (Records {start_index + 1}-{end_index}) ---"
+                            )
+                            future = executor.submit(
+                                send_dataframe_to_api,
+                                df_batch,
+                                API_BASE_URL,
+                                API_TARGET_SOURCE_PMLMDA,
+                                already_transformed=True,
+                            )
+                            futures[future] = i
+
+                        for future in as_completed(futures):
+                            i = futures[future]
+                            if future.result():
+                                logging.info(
+                                    f"Batch {i + 1}/{num_batches} sent successfully."
+                                )
+                                records_successfully_sent_count += len(batches[i])
+                            else:
+                                logging.error(
+                                    f"Failed to send Batch {i + 1}/{num_batches}. Check logs above."
+                                )
+                                overall_success = False
                 logging.info("--- API Upload Summary ---")
                 logging.info(f"Total records from processed files: {num_records}")
                 logging.info(
@@ -515,11 +651,8 @@ def get_pml_mda():
                     logging.info("All batches appear to have been sent successfully.")
                     # Optional: Save the combined CSV locally only if everything was sent
                     try:
+                        # 'Fecha' is already a YYYY-MM-DD string
                         df_final_to_save = df_sin_actualizado.copy()
-                        # Format date as string for CSV saving consistency
-                        df_final_to_save["Fecha"] = df_final_to_save[
-                            "Fecha"
-                        ].dt.strftime("%Y-%m-%d")
                     except Exception as e:
                         logging.error(f"Failed to save combined CSV locally: {e}")
                     return True  # Indicate overall success
@@ -528,18 +661,12 @@ def get_pml_mda():
                         "One or more batches failed to send, or record counts mismatch."
                     )
                     return False  # Indicate failure
-            # delete_csv_files(".")  # Replace "." with the target directory path
-
         else:
             logging.error("Files are not the same")
 
-    except FileNotFoundError as e:
-        logging.error(
-            f"Error: {e.filename} no encontrado. Asegúrate de que todos los CSV requeridos estén descargados."
-        )
-
     except Exception as e:
         logging.exception(f"Error inesperado: {e}")
 
 
-get_pml_mda()
+if __name__ == "__main__":
+    get_pml_mda()